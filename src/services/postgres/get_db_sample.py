@@ -1,22 +1,26 @@
 #!/usr/bin/env python3
 
 import json
-import os
 
-import psycopg2
-import psycopg2.extras
+import numpy as np
 
-from services.collector.utils import get_postgres_connection
+from services.scans.plot import SCAN_COLUMNS, decode_scan, query_scans
 
 
 def fetch_sample_data():
-    conn = get_postgres_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    query = "SELECT * FROM radar_scans LIMIT 1;"
-    cur.execute(query)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    """
+    Fetch one radar_scans row as a dict, with the reflectivity BYTEA decoded
+    to a rows x cols list of dBZ (None for masked gates).
+    """
+    columns = [c.strip() for c in SCAN_COLUMNS.split(",")]
+    rows = []
+    for scan in query_scans(limit=1):
+        row = dict(zip(columns, scan))
+        refl = decode_scan(scan)[2]
+        dbz = refl.astype(object)
+        dbz[np.isnan(refl)] = None
+        row["reflectivity"] = dbz.tolist()
+        rows.append(row)
     return rows
 
 
@@ -7,6 +7,8 @@ docker compose up -d
 echo "Waiting for PostgreSQL to start..."
 sleep 10
 
-docker compose exec postgres psql -U admin -d weather_db -c "CREATE TABLE IF NOT EXISTS radar_scans (id SERIAL PRIMARY KEY, radar_id TEXT, scan_time TIMESTAMPTZ, grid_data JSONB, min_lon NUMERIC, max_lon NUMERIC, min_lat NUMERIC, max_lat NUMERIC);"
+docker compose exec postgres psql -U admin -d weather_db -c "CREATE TABLE IF NOT EXISTS radar_scans (id SERIAL PRIMARY KEY, radar_id TEXT, scan_time TIMESTAMPTZ, reflectivity BYTEA, rows INT, cols INT, scale_factor REAL, add_offset REAL, codec TEXT, min_lon DOUBLE PRECISION, max_lon DOUBLE PRECISION, min_lat DOUBLE PRECISION, max_lat DOUBLE PRECISION, envelope BOX);"
+docker compose exec postgres psql -U admin -d weather_db -c "CREATE INDEX IF NOT EXISTS radar_scans_time_idx ON radar_scans (scan_time, id);"
+docker compose exec postgres psql -U admin -d weather_db -c "CREATE INDEX IF NOT EXISTS radar_scans_envelope_idx ON radar_scans USING GIST (envelope);"
 
 docker logs -f postgres
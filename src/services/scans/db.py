@@ -0,0 +1,37 @@
+import os
+from contextlib import contextmanager
+
+import psycopg2.pool
+
+_POOL = None
+
+
+def _get_pool():
+    global _POOL
+    if _POOL is None:
+        _POOL = psycopg2.pool.ThreadedConnectionPool(
+            1,
+            16,
+            host=os.getenv("PG_HOST", "localhost"),
+            database=os.getenv("PG_DATABASE", "weather_db"),
+            user=os.getenv("PG_USER", "admin"),
+            password=os.getenv("PG_PASSWORD", "password"),
+            port=os.getenv("PG_PORT", "5432"),
+        )
+    return _POOL
+
+
+@contextmanager
+def connection():
+    """
+    Borrow a connection from the shared Postgres pool.
+
+    The connection is returned to the pool on exit; any transaction left open
+    (e.g. after an exception) is rolled back by the pool.
+    """
+    pool = _get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
@@ -0,0 +1,57 @@
+import asyncio
+import contextlib
+import os
+
+import aiohttp
+
+NEXRAD_BUCKET_URL = "https://noaa-nexrad-level2.s3.amazonaws.com"
+
+
+async def _fetch_scan(session, scan, dest_dir):
+    # stream into a .part file and rename on success, so a failed download
+    # never leaves a truncated archive under the real name
+    path = os.path.join(dest_dir, scan.filename)
+    part = path + ".part"
+    try:
+        async with session.get(f"{NEXRAD_BUCKET_URL}/{scan.key}") as resp:
+            resp.raise_for_status()
+            with open(part, "wb") as f:
+                async for chunk in resp.content.iter_chunked(1 << 20):
+                    f.write(chunk)
+        os.replace(part, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(part)
+        raise
+    return path
+
+
+async def _fetch_scans(scans, dest_dir, max_connections):
+    # the connector limit caps how many GETs are in flight at once
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    # no total timeout: it would also count time spent queued behind the
+    # connector limit, failing the tail of long ranges
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await asyncio.gather(
+            *(_fetch_scan(session, scan, dest_dir) for scan in scans),
+            return_exceptions=True,
+        )
+
+
+def fetch_scans(scans, dest_dir, max_connections=32):
+    """
+    Download nexradaws scans into dest_dir and return the local paths of the
+    ones that succeeded; failures are reported and skipped.
+
+    The files are streamed concurrently over one aiohttp session.
+    """
+    results = asyncio.run(_fetch_scans(scans, dest_dir, max_connections))
+
+    paths = []
+    for scan, result in zip(scans, results):
+        if isinstance(result, Exception):
+            print(f"Failed to download {scan.filename}: {result}")
+        else:
+            paths.append(result)
+    return paths
@@ -0,0 +1,26 @@
+import numpy as np
+
+
+def sweep_bounds(lat0, lon0, azimuths, max_range):
+    """
+    (min_lon, max_lon, min_lat, max_lat) in degrees covered by a radar sweep.
+
+    The sweep is a spherical cap around the site (lat0/lon0 and azimuths in
+    degrees, max_range in meters), so its extremes lie on the rim: only the
+    last gate of each ray is projected, via the spherical forward geodesic.
+    """
+    R = 6371000.0  # Earth's radius in meters
+    lat0, lon0 = np.radians(lat0), np.radians(lon0)
+    az = np.radians(azimuths)
+    d = max_range / R
+    lats = np.arcsin(np.sin(lat0) * np.cos(d) + np.cos(lat0) * np.sin(d) * np.cos(az))
+    lons = lon0 + np.arctan2(
+        np.sin(az) * np.sin(d) * np.cos(lat0), np.cos(d) - np.sin(lat0) * np.sin(lats)
+    )
+    lats, lons = np.degrees(lats), np.degrees(lons)
+    return (
+        float(lons.min()),
+        float(lons.max()),
+        float(lats.min()),
+        float(lats.max()),
+    )
@@ -1,9 +1,29 @@
-from math import atan2, cos, radians, sin, sqrt
+import shelve
+from functools import lru_cache
+from math import asin, atan2, cos, degrees, radians, sin, sqrt
 
+import numexpr as ne
+import numpy as np
 import pandas as pd
 from geopy.geocoders import Nominatim
+from numba import njit
 
+from services.scans.utils import ALLOW_APPROX_TRIG, hav_fast
 
+# above this many candidate stations the parallel numba kernel beats numexpr
+NUMBA_THRESHOLD = 100_000
+
+GEOCODE_CACHE = "geocode_cache.db"
+
+STATION_DTYPES = {
+    "Latitude": "float32",
+    "Longitude": "float32",
+    "Radar ID": "string[pyarrow]",
+    "Site Name": "string[pyarrow]",
+}
+
+
+@njit(fastmath=ALLOW_APPROX_TRIG)
 def haversine_distance(lat1, lon1, lat2, lon2):
     """Calculate distance between two points (in km) using the Haversine formula."""
     R = 6371.0  # Earth's radius in kilometers
@@ -17,27 +37,90 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     return R * c
 
 
+def haversine_vector(lat1, lon1, lat2, lon2):
+    """
+    Vectorized Haversine distance (in km); arguments broadcast as NumPy arrays.
+
+    numexpr evaluates the whole expression blockwise in a single pass, so no
+    full-size temporaries are allocated; float32 inputs are upcast to float64
+    inside each block.
+    """
+    return ne.evaluate(
+        "2 * R * arcsin(sqrt("
+        "sin((lat2 - lat1) * k / 2) ** 2"
+        " + cos(lat1 * k) * cos(lat2 * k) * sin((lon2 - lon1) * k / 2) ** 2"
+        "))",
+        local_dict={
+            "lat1": lat1,
+            "lon1": lon1,
+            "lat2": lat2,
+            "lon2": lon2,
+            "R": 6371.0,  # Earth's radius in kilometers
+            "k": np.pi / 180,
+        },
+    )
+
+
+@lru_cache(maxsize=1024)
+def geocode_city(city):
+    """
+    Geocode a city name to (lat, lon), or None if Nominatim can't find it.
+
+    Hits are memoized in-process and persisted to GEOCODE_CACHE, so repeat
+    lookups skip the network round-trip (and Nominatim's rate limit).
+    """
+    with shelve.open(GEOCODE_CACHE) as cache:
+        if city in cache:
+            return cache[city]
+        location = Nominatim(user_agent="nexrad_locator").geocode(city)
+        if location is None:
+            return None
+        cache[city] = (location.latitude, location.longitude)
+        return cache[city]
+
+
 def get_nearby_radars(target_lat, target_lon, radius_km=100):
-    station_df = pd.read_csv("data/nexrad_stations.csv")
-    station_df["distance_km"] = station_df.apply(
-        lambda row: haversine_distance(
-            target_lat, target_lon, row["Latitude"], row["Longitude"]
-        ),
-        axis=1,
+    station_df = pd.read_csv(
+        "data/nexrad_stations.csv", usecols=list(STATION_DTYPES), dtype=STATION_DTYPES
     )
+
+    # cheap lat/lon box around the search circle so only candidates pay for the
+    # trig; the circle is widest in longitude poleward of its centre, where the
+    # half-width is asin(sin(d) / cos(lat)). Padded slightly for the float32
+    # station coordinates; no longitude limit once the circle reaches a pole
+    d = radius_km / 6371.0  # angular radius, Earth's radius in kilometers
+    dlat_deg = degrees(d) + 0.01
+    in_box = (station_df["Latitude"] - target_lat).abs() <= dlat_deg
+    if abs(target_lat) + dlat_deg < 90:
+        dlon_deg = degrees(asin(min(1.0, sin(d) / cos(radians(target_lat))))) + 0.01
+        dlon = (station_df["Longitude"] - target_lon + 180) % 360 - 180
+        in_box &= dlon.abs() <= dlon_deg
+    station_df = station_df[in_box].copy()
+
+    lats = station_df["Latitude"].to_numpy()
+    lons = station_df["Longitude"].to_numpy()
+    if len(station_df) > NUMBA_THRESHOLD:
+        station_df["distance_km"] = hav_fast(
+            radians(target_lat),
+            radians(target_lon),
+            np.radians(lats, dtype=np.float64),
+            np.radians(lons, dtype=np.float64),
+        )
+    else:
+        station_df["distance_km"] = haversine_vector(
+            target_lat, target_lon, lats, lons
+        )
     return station_df[station_df["distance_km"] <= radius_km].sort_values("distance_km")
 
 
 if __name__ == "__main__":
     city = input("Enter a city (or leave blank to input lat/lon): ").strip()
     if city:
-        geolocator = Nominatim(user_agent="nexrad_locator")
-        location = geolocator.geocode(city)
+        location = geocode_city(city)
         if location is None:
             print(f"Could not geocode '{city}'. Please check the city name.")
             exit(1)
-        target_lat = location.latitude
-        target_lon = location.longitude
+        target_lat, target_lon = location
         print(f"Coordinates for {city}: {target_lat}, {target_lon}")
     else:
         try:
@@ -1,73 +1,156 @@
 #!/usr/bin/env python3
 
-import json
 import os
+import sys
 
 import cartopy.crs as ccrs
 import matplotlib.pyplot as plt
 import numpy as np
-import psycopg2
+import zstandard
 
+from services.scans.db import connection
 
-def get_postgres_connection():
-    conn = psycopg2.connect(
-        host=os.getenv("PG_HOST", "localhost"),
-        database=os.getenv("PG_DATABASE", "weather_db"),
-        user=os.getenv("PG_USER", "admin"),
-        password=os.getenv("PG_PASSWORD", "password"),
-        port=os.getenv("PG_PORT", "5432"),
-    )
-    return conn
+SCAN_COLUMNS = """
+    radar_id, scan_time, reflectivity, rows, cols,
+    scale_factor, add_offset, codec,
+    min_lon, max_lon, min_lat, max_lat, id
+"""
 
 
-def query_scans():
+def query_scans(after=None, limit=100):
     """
-    Query the radar_scans table for all stored scans.
+    Query one page of the radar_scans table, ordered by (scan_time, id).
+
+    `after` is the (scan_time, id) key of the last row of the previous page;
+    the keyset WHERE clause lets Postgres seek straight to it on the
+    (scan_time, id) index instead of sorting the whole table.
     """
-    conn = get_postgres_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT radar_id, scan_time, grid_data, min_lon, max_lon, min_lat, max_lat
-        FROM radar_scans
-        ORDER BY scan_time;
-    """)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return rows
+    with connection() as conn, conn.cursor() as cur:
+        if after is None:
+            cur.execute(
+                f"SELECT {SCAN_COLUMNS} FROM radar_scans"
+                " ORDER BY scan_time, id LIMIT %s;",
+                (limit,),
+            )
+        else:
+            cur.execute(
+                f"SELECT {SCAN_COLUMNS} FROM radar_scans"
+                " WHERE (scan_time, id) > (%s, %s)"
+                " ORDER BY scan_time, id LIMIT %s;",
+                (*after, limit),
+            )
+        return cur.fetchall()
 
 
-def plot_scan_from_db(scan):
-    radar_id, scan_time, grid_data_json, min_lon, max_lon, min_lat, max_lat = scan
-    grid_data = json.loads(grid_data_json)
-    reflectivity = grid_data.get("reflectivity", [])
-    refl_array = np.array(reflectivity)
-    if refl_array.ndim == 1:
-        refl_array = refl_array.reshape(1, -1)
+def iter_scans(page_size=100):
+    """
+    Yield every stored scan, holding at most one page in memory.
+    """
+    after = None
+    while page := query_scans(after, page_size):
+        yield from page
+        after = (page[-1][1], page[-1][-1])
+
+
+def decode_scan(scan):
+    """
+    Unpack a query_scans row into (radar_id, scan_time, dBZ array, extent).
+    """
+    (
+        radar_id,
+        scan_time,
+        reflectivity,
+        rows,
+        cols,
+        scale_factor,
+        add_offset,
+        codec,
+        min_lon,
+        max_lon,
+        min_lat,
+        max_lat,
+        _scan_id,
+    ) = scan
+    if codec != "zstd":
+        raise ValueError(f"Unsupported reflectivity codec: {codec}")
+    q = np.frombuffer(
+        zstandard.ZstdDecompressor().decompress(reflectivity), dtype=np.uint8
+    ).reshape(rows, cols)
+    # 1-byte LUT back to dBZ; q == 0 marks masked gates
+    lut = np.arange(256, dtype=np.float32) * scale_factor + add_offset
+    lut[0] = np.nan
+    return radar_id, scan_time, lut[q], [min_lon, max_lon, min_lat, max_lat]
 
+
+def setup_axes(extent):
+    """
+    Build the figure, map axes, reflectivity image and colorbar once.
+
+    Frames are then drawn by update_scan, which only swaps the image data.
+    """
     projection = ccrs.PlateCarree()
     fig, ax = plt.subplots(figsize=(10, 8), subplot_kw={"projection": projection})
-    ax.set_extent([min_lon, max_lon, min_lat, max_lat])
+    ax.set_extent(extent)
 
     im = ax.imshow(
-        refl_array,
+        np.full((1, 1), np.nan, dtype=np.float32),
         origin="upper",
-        extent=[min_lon, max_lon, min_lat, max_lat],
+        extent=extent,
         cmap="HomeyerRainbow",
         vmin=-7.5,
         vmax=65,
         transform=ccrs.PlateCarree(),
     )
     plt.colorbar(im, ax=ax, orientation="horizontal", pad=0.05)
+    return fig, ax, im
+
+
+def scan_extent(scan):
+    """
+    [min_lon, max_lon, min_lat, max_lat] of a query_scans row, without
+    decoding its reflectivity.
+    """
+    return list(scan[8:12])
+
+
+def update_scan(ax, im, scan):
+    radar_id, scan_time, refl_array, extent = decode_scan(scan)
+    ax.set_extent(extent)
+    im.set_data(refl_array)
+    im.set_extent(extent)
     ax.set_title(f"Radar {radar_id} Reflectivity at {scan_time}")
+    return radar_id, scan_time
+
+
+def plot_scan_from_db(scan):
+    fig, ax, im = setup_axes(scan_extent(scan))
+    update_scan(ax, im, scan)
     plt.show()
 
 
+def save_scans_from_db(scans, out_dir):
+    """
+    Render every scan to out_dir as PNG, reusing a single figure.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    fig = None
+    for scan in scans:
+        if fig is None:
+            fig, ax, im = setup_axes(scan_extent(scan))
+        radar_id, scan_time = update_scan(ax, im, scan)
+        fig.savefig(os.path.join(out_dir, f"{radar_id}_{scan_time:%Y%m%d_%H%M}.png"))
+    if fig is not None:
+        plt.close(fig)
+
+
 def main():
-    scans = query_scans()
+    scans = query_scans(limit=1)
     if not scans:
         print("No scans found in the database.")
         return
+    if len(sys.argv) > 1:
+        save_scans_from_db(iter_scans(), sys.argv[1])
+        return
     first_scan = scans[0]
     plot_scan_from_db(first_scan)
 
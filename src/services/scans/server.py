@@ -1,46 +1,115 @@
 #!/usr/bin/env python3
 import os
-from math import atan2, cos, radians, sin, sqrt
+import time
+from datetime import datetime, timezone
 
 import nexradaws
+import numpy as np
+import orjson
 import pandas as pd
-import pyart
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
+from flask_caching import Cache
+from flask_orjson import OrjsonProvider
+from pyart.io.common import prepare_for_read
+from pyart.io.nexrad_level2 import NEXRADLevel2File
+from redis import Redis
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from scipy.spatial import cKDTree
+from werkzeug.security import safe_join
+
+from services.scans.fetch import fetch_scans
+from services.scans.geo import sweep_bounds
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+# let endpoints jsonify NumPy arrays/scalars directly
+app.json.option |= orjson.OPT_SERIALIZE_NUMPY
+cache = Cache(
+    app, config={"CACHE_TYPE": "SimpleCache", "CACHE_DEFAULT_TIMEOUT": 86400}
+)
 
 CACHE_DIR = os.path.join(os.getcwd(), "nexrad_cache")
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+# downloads run on an RQ worker so /api/download_scans returns as soon as the
+# job is queued. Start it from the server's working directory (data/ and
+# nexrad_cache/ are resolved against it) with the server importable under the
+# name it was started with, e.g. from the repo root:
+#   `rq worker downloads -P src -P src/services/scans`  (python .../server.py)
+#   `rq worker downloads -P src`  (app imported as services.scans.server)
+redis_conn = Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+download_queue = Queue("downloads", connection=redis_conn)
+# how long /api/download_status can still report a finished or failed job
+DOWNLOAD_RESULT_TTL = 24 * 3600
+# behind nginx, set to an internal location aliased to CACHE_DIR, e.g.
+#   location /_nexrad_cache/ { internal; alias /app/nexrad_cache/; sendfile on; }
+# so get_scan hands the file off via X-Accel-Redirect instead of streaming it
+X_ACCEL_LOCATION = os.getenv("X_ACCEL_LOCATION")
+
+
+# the station table never changes while the server runs: parse it once and
+# keep the coordinates pre-converted to radians
+_STATIONS = pd.read_csv(
+    "data/nexrad_stations.csv",
+    usecols=["Radar ID", "Site Name", "Latitude", "Longitude"],
+    dtype={
+        "Radar ID": "string",
+        "Site Name": "string",
+        "Latitude": "float32",
+        "Longitude": "float32",
+    },
+)
+_STATION_LAT_RAD = np.radians(_STATIONS["Latitude"].to_numpy(), dtype=np.float64)
+_STATION_LON_RAD = np.radians(_STATIONS["Longitude"].to_numpy(), dtype=np.float64)
+
+
+def _unit_vectors(lat, lon):
+    """Points on the unit sphere (lat/lon in radians) as (..., 3) xyz."""
+    return np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1
+    )
+
+
+# KD-tree over the stations that have coordinates; radius queries on the unit
+# sphere use chord length, which is monotonic in great-circle distance
+_STATION_ROWS = np.flatnonzero(
+    np.isfinite(_STATION_LAT_RAD) & np.isfinite(_STATION_LON_RAD)
+)
+_STATION_TREE = cKDTree(
+    _unit_vectors(_STATION_LAT_RAD[_STATION_ROWS], _STATION_LON_RAD[_STATION_ROWS])
+)
+
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points (in km) using the Haversine formula."""
+def _haversine_radians(lat1, lon1, lat2, lon2):
     R = 6371.0  # Earth's radius in kilometers
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = (
-        sin(dlat / 2) ** 2
-        + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-    )
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
     return R * c
 
 
 def get_nearby_radars(target_lat, target_lon, radius_km=100):
-    station_df = pd.read_csv("data/nexrad_stations.csv")
-    station_df["distance_km"] = station_df.apply(
-        lambda row: haversine_distance(
-            target_lat, target_lon, row["Latitude"], row["Longitude"]
-        ),
-        axis=1,
+    R = 6371.0  # Earth's radius in kilometers
+    lat, lon = np.radians(target_lat), np.radians(target_lon)
+    chord = 2 * np.sin(min(radius_km / R, np.pi) / 2)
+    hits = _STATION_TREE.query_ball_point(_unit_vectors(lat, lon), chord)
+    nearby = _STATION_ROWS[np.asarray(hits, dtype=np.intp)]
+
+    distance_km = _haversine_radians(
+        lat, lon, _STATION_LAT_RAD[nearby], _STATION_LON_RAD[nearby]
     )
-    return station_df[station_df["distance_km"] <= radius_km].sort_values("distance_km")
+    order = np.argsort(distance_km)
+    order = order[distance_km[order] <= radius_km]
+    return _STATIONS.iloc[nearby[order]].assign(distance_km=distance_km[order])
 
 
 def get_scan_metadata(filename):
     """
-    Open the radar scan file using Py-ART and extract metadata.
-    Assumes the file is a NEXRAD level II archive.
+    Read the radar scan's Level II records (without building a Py-ART Radar)
+    and extract metadata. Assumes the file is a NEXRAD level II archive.
 
     Returns a dict with:
       - filename
@@ -50,35 +119,41 @@ def get_scan_metadata(filename):
     """
     file_path = os.path.join(CACHE_DIR, filename)
     try:
-        radar = pyart.io.read_nexrad_archive(file_path)
+        nfile = NEXRADLevel2File(prepare_for_read(file_path))
     except Exception as e:
         return {"error": f"Failed to read radar file: {e}"}
 
     try:
-        scan_time = pd.to_datetime(filename[4:17], format="%Y%m%d_%H%M").tz_localize(
-            "UTC"
+        scan_time = datetime.strptime(filename[4:17], "%Y%m%d_%H%M").replace(
+            tzinfo=timezone.utc
         )
     except Exception as _:
         scan_time = None
 
-    if "reflectivity" not in radar.fields:
+    scan_info = nfile.scan_info()
+    ref_ngates = [
+        info["ngates"][info["moments"].index("REF")]
+        for info in scan_info
+        if "REF" in info["moments"]
+    ]
+    if not ref_ngates:
+        nfile.close()
         return {"error": "No reflectivity field found in scan."}
 
-    reflectivity_data = radar.fields["reflectivity"]["data"]
-    rows, cols = reflectivity_data.shape
+    # same shape Py-ART would give the reflectivity field: every ray in the
+    # volume by the longest reflectivity radial
+    rows = sum(info["nrays"] for info in scan_info)
+    cols = max(ref_ngates)
 
     try:
-        lats, lons, _ = radar.get_gate_lat_lon_alt(
-            sweep=0
-        )  # NOTE: this is just for sweep 0
-        lats_sweep = lats[0]
-        lons_sweep = lons[0]
-        min_lon_val = float(lons_sweep.min())
-        max_lon_val = float(lons_sweep.max())
-        min_lat_val = float(lats_sweep.min())
-        max_lat_val = float(lats_sweep.max())
+        lat0, lon0, _ = nfile.location()
+        min_lon_val, max_lon_val, min_lat_val, max_lat_val = sweep_bounds(
+            lat0, lon0, nfile.get_azimuth_angles([0]), nfile.get_range(0, "REF")[-1]
+        )
     except Exception as e:
         return {"error": f"Failed to compute bounds: {e}"}
+    finally:
+        nfile.close()
 
     return {
         "filename": filename,
@@ -92,7 +167,57 @@ def get_scan_metadata(filename):
     }
 
 
+# (CACHE_DIR mtime, when it was scanned, sorted scan filenames); the
+# directory's mtime changes whenever an entry is added, removed or renamed,
+# whether by this process, the download worker or anything else sharing the
+# volume
+_scan_index = (None, 0, [])
+
+# with coarse directory timestamps (older kernels, some volume mounts) an entry
+# added in the same tick as the cached stat leaves the mtime unchanged, so, as
+# git does for racily-clean files, an mtime this close to the last scan isn't
+# trusted and the directory is rescanned
+RACY_MTIME_NS = 1_000_000_000
+
+
+def _cached_scans():
+    """
+    Sorted scan filenames in CACHE_DIR (MDM and in-progress .part files
+    excluded), rescanned only when the directory has changed since the last
+    call.
+    """
+    global _scan_index
+    cached_mtime, scanned_at, scans = _scan_index
+    now = time.time_ns()
+    # stat before scanning, so a change made mid-scan triggers another rescan
+    mtime = os.stat(CACHE_DIR).st_mtime_ns
+    if mtime != cached_mtime or mtime >= scanned_at - RACY_MTIME_NS:
+        with os.scandir(CACHE_DIR) as entries:
+            scans = sorted(
+                e.name
+                for e in entries
+                if e.is_file() and not e.name.endswith(("MDM", ".part"))
+            )
+        _scan_index = (mtime, now, scans)
+    return scans
+
+
+def _is_ok(rv):
+    """Only cache successful responses (error views return (body, status))."""
+    return getattr(rv, "status_code", None) == 200
+
+
+def _metadata_cache_key(filename):
+    # scan files are immutable once downloaded; mtime covers a re-download
+    try:
+        mtime = os.path.getmtime(os.path.join(CACHE_DIR, filename))
+    except OSError:
+        mtime = None
+    return f"meta:{filename}:{mtime}"
+
+
 @app.route("/")
+@cache.cached(timeout=0)  # the route table is fixed once the app is built
 def index():
     """
     Landing page that lists all available routes.
@@ -138,12 +263,7 @@ def list_scans():
     List relevant available radar scan files
     """
     try:
-        files = [
-            f
-            for f in os.listdir(CACHE_DIR)
-            if os.path.isfile(os.path.join(CACHE_DIR, f)) and not f.endswith("MDM")
-        ]
-        return jsonify({"scans": files})
+        return jsonify({"scans": _cached_scans()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -154,12 +274,22 @@ def get_scan(filename):
     Serve a specific radar scan file from the cache directory.
     """
     try:
+        if X_ACCEL_LOCATION:
+            path = safe_join(CACHE_DIR, filename)
+            if path is None or not os.path.isfile(path):
+                return jsonify({"error": f"{filename} not found"}), 404
+            r = Response(content_type="application/octet-stream")
+            r.headers["X-Accel-Redirect"] = (
+                f"{X_ACCEL_LOCATION.rstrip('/')}/{filename}"
+            )
+            return r
         return send_from_directory(CACHE_DIR, filename)
     except Exception as e:
         return jsonify({"error": str(e)}), 404
 
 
 @app.route("/api/metadata/<path:filename>", methods=["GET"])
+@cache.cached(make_cache_key=_metadata_cache_key, response_filter=_is_ok)
 def get_metadata(filename):
     """
     Retrieve metadata for a specific radar scan file.
@@ -170,10 +300,29 @@ def get_metadata(filename):
     return jsonify(meta)
 
 
+def download_scans_task(radar_id, start, end):
+    """
+    RQ job: download all scans for radar_id in [start, end] (ISO strings)
+    into CACHE_DIR and return the downloaded filenames.
+    """
+    aws = nexradaws.NexradAwsInterface()
+    scans = aws.get_avail_scans_in_range(
+        pd.Timestamp(start), pd.Timestamp(end), radar_id
+    )
+    if not scans:
+        return []
+
+    paths = fetch_scans(scans, CACHE_DIR)
+    if not paths:
+        # fail the job instead of reporting an empty success
+        raise RuntimeError(f"All {len(scans)} scan downloads failed")
+    return [os.path.basename(path) for path in paths]
+
+
 @app.route("/api/download_scans", methods=["POST"])
 def download_scans_endpoint():
     """
-    Trigger a download of new radar scans.
+    Queue a download of new radar scans.
 
     Expected JSON payload:
       {
@@ -182,8 +331,8 @@ def download_scans_endpoint():
          "end": "2020-08-10T21:00:00Z"    //
       }
 
-    This endpoint downloads available scans into the CACHE_DIR and returns
-    a list of downloaded filenames.
+    The scans are downloaded into CACHE_DIR by a worker; this endpoint
+    returns a task_id right away, to be polled at /api/download_status.
     """
     data = request.get_json()
     radar_id = data.get("radar_id", "KDVN")
@@ -193,18 +342,44 @@ def download_scans_endpoint():
     except Exception as e:
         return jsonify({"error": "Invalid start or end time", "details": str(e)}), 400
 
-    aws = nexradaws.NexradAwsInterface()
-    scans = aws.get_avail_scans_in_range(start, end, radar_id)
-
-    if scans is None:
-        return jsonify(
-            {"error": "No scans available for the given time range and radar ID."}
-        ), 404
+    # enqueue by import path; run as a script this module is __main__, which
+    # the worker can't import, so fall back to the file's own module name
+    module = download_scans_task.__module__
+    if module == "__main__":
+        module = os.path.splitext(os.path.basename(__file__))[0]
+    job = download_queue.enqueue(
+        f"{module}.download_scans_task",
+        radar_id,
+        start.isoformat(),
+        end.isoformat(),
+        job_timeout=3600,
+        result_ttl=DOWNLOAD_RESULT_TTL,
+        failure_ttl=DOWNLOAD_RESULT_TTL,
+    )
+    return jsonify({"task_id": job.id}), 202
 
-    results = aws.download(scans, CACHE_DIR, threads=os.cpu_count() // 2)
 
-    downloaded_files = [scan.filename for scan in results.iter_success()]
-    return jsonify({"downloaded_files": downloaded_files})
+@app.route("/api/download_status/<task_id>", methods=["GET"])
+def download_status(task_id):
+    """
+    Report the status of a queued download; once finished, the response also
+    lists the downloaded filenames, and a failed job reports its error.
+    """
+    try:
+        job = Job.fetch(task_id, connection=redis_conn)
+    except NoSuchJobError:
+        return jsonify({"error": f"Unknown task {task_id}"}), 404
+
+    status = job.get_status()
+    result = {"task_id": job.id, "status": status}
+    if status == "finished":
+        result["downloaded_files"] = job.return_value()
+    elif status == "failed":
+        latest = job.latest_result()
+        exc = latest.exc_string if latest is not None else None
+        # last traceback line, e.g. "RuntimeError: All 3 scan downloads failed"
+        result["error"] = exc.strip().splitlines()[-1] if exc else "Download failed"
+    return jsonify(result)
 
 
 @app.route("/api/get_stations", methods=["POST"])
@@ -220,11 +395,12 @@ def get_stations():
     target_lon = data.get("target_lon")
     radius_km = data.get("radius_km", 200)
 
+    radars = get_nearby_radars(target_lat, target_lon, radius_km)
     return jsonify(
         {
-            "radars": get_nearby_radars(target_lat, target_lon, radius_km)[
-                ["Radar ID", "Site Name", "distance_km"]
-            ]
+            "radars": radars[["Radar ID", "Site Name", "distance_km"]].to_dict(
+                orient="records"
+            )
         }
     )
 
@@ -1,125 +1,217 @@
 #!/usr/bin/env python3
 
-import json
+import io
 import os
+import struct
 import tempfile
-from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import islice
 
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import matplotlib.pyplot as plt
 import nexradaws
 import numpy as np
 import pandas as pd
-import psycopg2
 import pyart
-import pytz
-from metpy.plots import USCOUNTIES
-from pyart.core import Radar
-
-
-def get_postgres_connection():
-    conn = psycopg2.connect(
-        host=os.getenv("PG_HOST", "localhost"),
-        database=os.getenv("PG_DATABASE", "weather_db"),
-        user=os.getenv("PG_USER", "admin"),
-        password=os.getenv("PG_PASSWORD", "password"),
-        port=os.getenv("PG_PORT", "5432"),
-    )
-    return conn
+import zstandard
+
+from services.scans.db import connection
+from services.scans.fetch import fetch_scans
+from services.scans.geo import sweep_bounds
+
+# kept apart from the scan cache (nexrad_cache), which the server lists as scans
+SPC_CACHE_DIR = os.path.join(os.getcwd(), "spc_cache")
 
 
 def download_scans(radar_id, start, end, temp_dir):
+    """
+    Download all scans in [start, end] into temp_dir and return their local paths.
+
+    nexradaws is only used for the listing; see fetch.fetch_scans for the
+    download itself.
+    """
     conn = nexradaws.NexradAwsInterface()
     scans = conn.get_avail_scans_in_range(start, end, radar_id)
-    if scans is None:
+    if not scans:
         print("No scans available for the given time range and radar ID.")
         return []
     print(
         f"There are {len(scans)} scans available between {start} and {end}\n")
     print(scans[0: len(scans) // 4])
-    results = conn.download(scans, temp_dir, threads=os.cpu_count())
-    return results
-
-
-def load_and_convert(url, start, end):
-    df = pd.read_csv(url)
-    df["datetime"] = pd.to_datetime(df.date + " " + df.time)
-    df.set_index("datetime", inplace=True)
-    df.index = df.index.tz_localize(
-        "Etc/GMT+6", ambiguous="NaT", nonexistent="shift_forward"
-    ).tz_convert("UTC")
-    df.sort_index(inplace=True)
+    return fetch_scans(scans, temp_dir, max_connections=64)
+
+
+# SPC report columns we keep: local date/time, state, magnitude (F/EF scale,
+# knots or inches by kind), casualties and start/end points
+SPC_DTYPES = {
+    "date": "str",
+    "time": "str",
+    "st": "category",
+    "mag": "float32",
+    "inj": "int32",
+    "fat": "int32",
+    "slat": "float32",
+    "slon": "float32",
+    "elat": "float32",
+    "elon": "float32",
+}
+
+
+def load_and_convert(year, kind, start, end):
+    """
+    Load one SPC severe report CSV (kind is wind/torn/hail) indexed by UTC time.
+
+    Parsed reports for past years are cached as Parquet in SPC_CACHE_DIR; the
+    current year is still being appended to upstream, so it is always fetched.
+    """
+    cache_path = os.path.join(SPC_CACHE_DIR, f"spc_{kind}_{year}.parquet")
+    if os.path.exists(cache_path):
+        df = pd.read_parquet(cache_path)
+    else:
+        df = pd.read_csv(
+            f"https://www.spc.noaa.gov/wcm/data/{year}_{kind}.csv",
+            usecols=list(SPC_DTYPES),
+            dtype=SPC_DTYPES,
+        )
+        df.index = pd.DatetimeIndex(
+            pd.to_datetime(
+                df.pop("date") + " " + df.pop("time"),
+                format="%Y-%m-%d %H:%M:%S",
+                cache=True,
+            ),
+            name="datetime",
+        )
+        df.index = df.index.tz_localize(
+            "Etc/GMT+6", ambiguous="NaT", nonexistent="shift_forward"
+        ).tz_convert("UTC")
+        df.sort_index(inplace=True)
+        if year < datetime.now().year:
+            os.makedirs(SPC_CACHE_DIR, exist_ok=True)
+            df.to_parquet(cache_path)
     start_str = (start - pd.Timedelta(minutes=30)).strftime("%Y-%m-%d %H:%M")
     end_str = (end + pd.Timedelta(minutes=30)).strftime("%Y-%m-%d %H:%M")
     return df[start_str:end_str]
 
 
 def load_severe_reports(year, start, end):
-    year_str = str(year)
-    wind_url = f"https://www.spc.noaa.gov/wcm/data/{year_str}_wind.csv"
-    torn_url = f"https://www.spc.noaa.gov/wcm/data/{year_str}_torn.csv"
-    hail_url = f"https://www.spc.noaa.gov/wcm/data/{year_str}_hail.csv"
-    wind_rpts = load_and_convert(wind_url, start, end)
-    tor_rpts = load_and_convert(torn_url, start, end)
-    hail_rpts = load_and_convert(hail_url, start, end)
+    wind_rpts = load_and_convert(year, "wind", start, end)
+    tor_rpts = load_and_convert(year, "torn", start, end)
+    hail_rpts = load_and_convert(year, "hail", start, end)
     return wind_rpts, tor_rpts, hail_rpts
 
 
-def store_scan_in_postgres(scan, radar, radar_id):
-<<<<<<< HEAD:src/services/collector/store.py
-    scan_time = pd.to_datetime(
-        scan.filename[4:17], format="%Y%m%d_%H%M").tz_localize("UTC")
-=======
-    scan_time = pd.to_datetime(scan.filename[4:17], format="%Y%m%d_%H%M").tz_localize(
-        "UTC"
+COPY_SCANS_SQL = """
+COPY radar_scans (radar_id, scan_time, reflectivity, rows, cols,
+                  scale_factor, add_offset, codec,
+                  min_lon, max_lon, min_lat, max_lat, envelope)
+FROM STDIN (FORMAT BINARY)
+"""
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+# reflectivity is stored as uint8 q with dBZ = q * REFL_SCALE + REFL_OFFSET;
+# q == 0 is reserved for masked gates, so 1..254 maps exactly onto Level II
+# REF's own 8-bit range of -32..94.5 dBZ and the encoding is lossless
+REFL_SCALE = 0.5
+REFL_OFFSET = -32.5
+REFL_CODEC = "zstd"
+
+
+def pack_scan(filename, radar):
+    """
+    Extract the radar_scans column values (minus radar_id) from a decoded scan.
+
+    Only plain Python/bytes values are returned so the result can cross a
+    process boundary without pickling the Radar object.
+    """
+    scan_time = datetime.strptime(filename[4:17], "%Y%m%d_%H%M").replace(
+        tzinfo=timezone.utc
     )
->>>>>>> 282b30fbce6e71857f83e7e4bc1c86e3f08f13ec:src/services/scans/store.py
-
-    reflectivity_data = radar.fields["reflectivity"]["data"][0]
-    reflectivity_list = reflectivity_data.tolist()
-
-    lats, lons, alts = radar.get_gate_lat_lon_alt(sweep=0)
-
-    lats_sweep = lats[0]
-    lons_sweep = lons[0]
-    min_lon_val = float(lons_sweep.min())
-    max_lon_val = float(lons_sweep.max())
-    min_lat_val = float(lats_sweep.min())
-    max_lat_val = float(lats_sweep.max())
-
-    grid_data = {
-        "reflectivity": reflectivity_list,
-        "min_lon": min_lon_val,
-        "max_lon": max_lon_val,
-        "min_lat": min_lat_val,
-        "max_lat": max_lat_val,
-    }
-
-    conn = get_postgres_connection()
-    cur = conn.cursor()
-    insert_sql = """
-    INSERT INTO radar_scans (radar_id, scan_time, grid_data, min_lon, max_lon, min_lat, max_lat)
-    VALUES (%s, %s, %s, %s, %s, %s, %s)
+
+    # sweep 0 (rays x gates) quantized to uint8 and zstd-compressed
+    reflectivity_data = radar.get_field(0, "reflectivity")
+    refl_array = np.ma.filled(reflectivity_data, np.nan)
+    rows, cols = refl_array.shape
+    q = np.round((refl_array - REFL_OFFSET) / REFL_SCALE)
+    q = np.where(np.isnan(q), 0, np.clip(q, 1, 255)).astype(np.uint8)
+    refl_bytes = zstandard.ZstdCompressor(level=3).compress(q.tobytes())
+
+    min_lon_val, max_lon_val, min_lat_val, max_lat_val = sweep_bounds(
+        radar.latitude["data"][0],
+        radar.longitude["data"][0],
+        radar.get_azimuth(0),
+        radar.range["data"][-1],
+    )
+
+    return (
+        scan_time,
+        refl_bytes,
+        rows,
+        cols,
+        min_lon_val,
+        max_lon_val,
+        min_lat_val,
+        max_lat_val,
+    )
+
+
+def _decode_and_pack(path):
+    radar = pyart.io.read_nexrad_archive(path)
+    return pack_scan(os.path.basename(path), radar)
+
+
+def _copy_tuple(radar_id, packed):
+    """
+    Encode one packed scan as a binary COPY tuple (see COPY_SCANS_SQL).
     """
-    cur.execute(
-        insert_sql,
-        (
-            radar_id,
-            scan_time,
-            json.dumps(grid_data),
-            min_lon_val,
-            max_lon_val,
-            min_lat_val,
-            max_lat_val,
-        ),
+    scan_time, refl, rows, cols, min_lon, max_lon, min_lat, max_lat = packed
+    fields = (
+        radar_id.encode(),
+        struct.pack(">q", (scan_time - PG_EPOCH) // timedelta(microseconds=1)),
+        refl,
+        struct.pack(">i", rows),
+        struct.pack(">i", cols),
+        struct.pack(">f", REFL_SCALE),
+        struct.pack(">f", REFL_OFFSET),
+        REFL_CODEC.encode(),
+        struct.pack(">d", min_lon),
+        struct.pack(">d", max_lon),
+        struct.pack(">d", min_lat),
+        struct.pack(">d", max_lat),
+        # box is sent as (high.x, high.y, low.x, low.y) with x = lon, y = lat
+        struct.pack(">dddd", max_lon, max_lat, min_lon, min_lat),
     )
-    conn.commit()
-    cur.close()
-    conn.close()
+    parts = [struct.pack(">h", len(fields))]
+    for field in fields:
+        parts += [struct.pack(">i", len(field)), field]
+    return b"".join(parts)
+
+
+def store_scans_in_postgres(packed_scans, radar_id, batch_size=32):
+    """
+    Bulk load packed scans (see pack_scan) with binary COPY in one transaction.
+
+    Scans are consumed lazily and copied batch_size at a time, so a generator
+    or executor map can be passed straight through.
+    """
+    packed_scans = iter(packed_scans)
+    with connection() as conn, conn.cursor() as cur:
+        while batch := list(islice(packed_scans, batch_size)):
+            buf = io.BytesIO()
+            buf.write(PGCOPY_HEADER)
+            for packed in batch:
+                buf.write(_copy_tuple(radar_id, packed))
+            buf.write(PGCOPY_TRAILER)
+            buf.seek(0)
+            cur.copy_expert(COPY_SCANS_SQL, buf)
+        conn.commit()
     print("  Stored in Postgres.", end="\n\n")
 
 
+def store_scan_in_postgres(scan, radar, radar_id):
+    store_scans_in_postgres([pack_scan(scan.filename, radar)], radar_id)
+
+
 def main(radar_id="KDVN"):
     start = pd.Timestamp(2020, 8, 10, 16, 30).tz_localize("UTC")
     end = pd.Timestamp(2020, 8, 10, 21, 0).tz_localize("UTC")
@@ -134,12 +226,10 @@ def main(radar_id="KDVN"):
 
     # wind_rpts, tor_rpts, hail_rpts = load_severe_reports(start.year, start, end)
 
-    for i, scan in enumerate(scans.iter_success(), start=1):
-        if scan.filename[-3:] == "MDM":
-            continue
-        print(f"Processing scan: {scan.filename}")
-        radar = scan.open_pyart()
-        store_scan_in_postgres(scan, radar, radar_id)
+    paths = [path for path in scans if path[-3:] != "MDM"]
+    print(f"Processing {len(paths)} scans")
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        store_scans_in_postgres(ex.map(_decode_and_pack, paths), radar_id)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,30 @@
+import os
+from math import asin, cos, sin, sqrt
+
+import numpy as np
+from numba import njit, prange
+
+# let LLVM use fastmath (reassociation, approximate/vectorized trig) in the
+# haversine kernels; error stays well under 1 m at 200 km. Kernels compiled
+# with this flag must not use cache=True: numba's on-disk cache isn't keyed on
+# fastmath, so a stale build would ignore a changed setting
+ALLOW_APPROX_TRIG = os.getenv("ALLOW_APPROX_TRIG", "1") == "1"
+
+
+@njit(parallel=True, fastmath=ALLOW_APPROX_TRIG)
+def hav_fast(lat1, lon1, lat2, lon2):
+    """
+    Haversine distances (in km) from one point to many, in parallel.
+
+    lat1/lon1 are scalars and lat2/lon2 1-D arrays, all in radians.
+    """
+    R = 6371.0  # Earth's radius in kilometers
+    out = np.empty(lat2.size)
+    cos_lat1 = cos(lat1)
+    for j in prange(lat2.size):
+        a = (
+            sin((lat2[j] - lat1) / 2) ** 2
+            + cos_lat1 * cos(lat2[j]) * sin((lon2[j] - lon1) / 2) ** 2
+        )
+        out[j] = 2 * R * asin(sqrt(a))
+    return out